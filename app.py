@@ -1,20 +1,23 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 
-import os, json, time, logging
+import os, time, logging, threading, queue, atexit, copy
 from logging.handlers import RotatingFileHandler
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, Optional, List
-import fcntl
+from typing import Any, Dict, Optional, List, Tuple
 
+import msgspec
+import orjson
 import requests
 from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool
 from urllib3.util.retry import Retry
 
 from flask import Flask, request, jsonify, abort
+from flask.json.provider import JSONProvider
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
 # -------------------- Konfiguration --------------------
 PSU_BASE      = os.getenv("PSU_BASE", "http://192.168.4.1")
@@ -22,6 +25,10 @@ HTTP_TIMEOUT  = float(os.getenv("HTTP_TIMEOUT", "5.0"))
 API_TOKEN     = os.getenv("API_TOKEN", "")
 STATE_FILE    = Path(os.getenv("STATE_FILE", "/var/lib/psu-bridge/state.json"))
 PORT          = int(os.getenv("PORT", "8000"))
+HTTP_POOL_MAX = int(os.getenv("HTTP_POOL_MAX", "32"))
+STATUS_TTL    = float(os.getenv("STATUS_TTL", "1.0"))
+HEALTH_TTL    = float(os.getenv("HEALTH_TTL", "3.0"))
+RATELIMIT_STORAGE = os.getenv("RATELIMIT_STORAGE", "memory://")
 
 # Sicherheitsgrenzen (bei Bedarf an Gerät anpassen)
 VOLT_MIN, VOLT_MAX = 0.0, 100.0
@@ -31,86 +38,210 @@ CURR_MIN, CURR_MAX = 0.0, 50.0
 BALANCED_AMP_ENV = float(os.getenv("BALANCED_AMP", "1.0"))
 
 # -------------------- Flask & Limiter --------------------
+def _json_default(obj: Any) -> Any:
+    # State-Snapshots (msgspec.Struct) serialisieren
+    if isinstance(obj, msgspec.Struct):
+        return msgspec.structs.asdict(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+class OrjsonProvider(JSONProvider):
+    """jsonify/get_json über orjson; Responses direkt als bytes."""
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(obj, default=_json_default).decode()
+
+    def loads(self, s: str | bytes, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=_json_default), mimetype="application/json")
+
 app = Flask(__name__)
-limiter = Limiter(key_func=get_remote_address)
+app.json = OrjsonProvider(app)
+# Prozesslokaler Speicher: keine externen Roundtrips pro Request
+limiter = Limiter(key_func=get_remote_address, storage_uri=RATELIMIT_STORAGE, strategy="fixed-window")
 limiter.init_app(app)
 _limit = limiter.limit  # Alias
 
 # -------------------- Logging --------------------
+_ISO = "%04d-%02d-%02dT%02d:%02d:%02dZ"
+
+class _IsoFormatter(logging.Formatter):
+    """asctime als UTC-ISO, je Sekunde nur einmal formatiert (statt strftime pro Record)."""
+    _cached: Tuple[int, str] = (-1, "")
+
+    def formatTime(self, record: logging.LogRecord, datefmt: Optional[str] = None) -> str:
+        s = int(record.created)
+        last_s, last_str = _IsoFormatter._cached
+        if s != last_s:
+            tm = time.gmtime(s)
+            last_str = _ISO % (tm.tm_year, tm.tm_mon, tm.tm_mday, tm.tm_hour, tm.tm_min, tm.tm_sec)
+            _IsoFormatter._cached = (s, last_str)
+        return last_str
+
+_log_formatter = _IsoFormatter("%(asctime)s %(levelname)s: %(message)s")
+
 app_logger = logging.getLogger("psu_bridge")
 app_logger.setLevel(logging.INFO)
 
 stream_handler = logging.StreamHandler()
-stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s: %(message)s"))
+stream_handler.setFormatter(_log_formatter)
 app_logger.addHandler(stream_handler)
 
 # State-Verzeichnis + File-Logger
 STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
 file_handler = RotatingFileHandler(STATE_FILE.parent / "psu.log", maxBytes=1_000_000, backupCount=3)
-file_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s: %(message)s"))
+file_handler.setFormatter(_log_formatter)
 app_logger.addHandler(file_handler)
 
 # -------------------- HTTP Session (Reuse + Pool) --------------------
+_psu_connections_opened = 0
+
+class _CountingPool(HTTPConnectionPool):
+    """Zählt neu geöffnete Sockets -> Keep-Alive-Regressionen werden sichtbar."""
+    def _new_conn(self):
+        global _psu_connections_opened
+        _psu_connections_opened += 1
+        app_logger.info(f"Neue PSU-Verbindung #{_psu_connections_opened} zu {self.host}:{self.port}")
+        return super()._new_conn()
+
 session = requests.Session()
-# Keine urllib3-internen Retries -> wir steuern Retries mit tenacity
-adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=Retry(total=0, redirect=0, connect=0, read=0))
+# Nur ein Host (PSU_BASE) -> ein Pool; pool_block statt Wegwerf-Verbindungen bei Überlast.
+# Keine urllib3-internen Retries -> wir steuern Retries selbst (_psu_request)
+adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_MAX, pool_block=True,
+                      max_retries=Retry(total=0, redirect=0, connect=0, read=0))
+adapter.poolmanager.pool_classes_by_scheme = {**adapter.poolmanager.pool_classes_by_scheme, "http": _CountingPool}
 session.mount("http://", adapter)
-session.mount("https://", adapter)
 session.headers.update({"Connection": "keep-alive"})
 
-# -------------------- State (persist + Cache) --------------------
-_state_cache: Dict[str, Any] = {}
-_cache_time: float = 0.0
+# Einmal beim Import vorberechnet statt pro Request
+_TIMEOUT = (HTTP_TIMEOUT, HTTP_TIMEOUT)  # (connect, read)
+_PSU_URLS = {p: PSU_BASE + p for p in ("/api/chargeStatus", "/api/send_data")}
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# -------------------- State (im Speicher + asynchron persistiert) --------------------
+# Der Prozess ist einziger Schreiber: _STATE ist die Wahrheit, das Statefile
+# wird von einem Hintergrund-Thread nachgezogen (Bursts innerhalb STATE_FLUSH_DELAY
+# werden zu einem Schreibvorgang zusammengefasst -> schont die SD-Karte).
+# _STATE = (revision, State) wird nur als Ganzes ersetzt, State ist frozen
+# -> Leser brauchen weder Lock noch Kopie.
+STATE_FLUSH_DELAY = 0.2
+
+_state_lock = threading.Lock()
+_write_lock = threading.Lock()
+_persist_queue: "queue.Queue[int]" = queue.Queue()
+_persisted_rev = 0
 
 def _clamp_balanced_amp(v: float) -> float:
     return max(1.0, min(5.0, v))
 
 def _now_iso() -> str:
-    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
-
-def load_state() -> Dict[str, Any]:
-    """Thread-safe Laden mit 1s Cache zur I/O-Reduktion."""
-    global _state_cache, _cache_time
-    now = time.time()
-    if (now - _cache_time) < 1.0 and _state_cache:
-        return _state_cache.copy()
-
-    if not STATE_FILE.exists():
-        state = {"voltage": None, "max_current": None, "access": "0", "updated_at": None}
-        save_state(state)
-        _state_cache = state
-        _cache_time = now
-        return state.copy()
-
-    with STATE_FILE.open("r") as f:
-        fcntl.flock(f.fileno(), fcntl.LOCK_SH)
+    # %-Formatierung statt strftime: kein Format-Parser/Locale pro Aufruf
+    tm = time.gmtime(int(time.time()))
+    return _ISO % (tm.tm_year, tm.tm_mon, tm.tm_mday, tm.tm_hour, tm.tm_min, tm.tm_sec)
+
+class State(msgspec.Struct, frozen=True):
+    """Persistierter Soll-State; fehlende Felder bekommen beim Decode die Defaults."""
+    voltage: Optional[float] = None
+    max_current: Optional[float] = None
+    access: str = "0"
+    updated_at: Optional[str] = None
+
+_state_decoder = msgspec.json.Decoder(State)
+_state_encoder = msgspec.json.Encoder()
+
+def _salvage_state(raw: Any) -> State:
+    """Feldweise übernehmen, was gültig ist – ein falsches Feld kostet nicht den ganzen State."""
+    if not isinstance(raw, dict):
+        return State()
+    fields: Dict[str, Any] = {}
+    for f in msgspec.structs.fields(State):
+        if f.name not in raw:
+            continue
+        value = raw[f.name]
         try:
-            data = json.load(f)
-        finally:
-            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
-
-    # Minimal-Validierung
-    for k in ("voltage", "max_current", "access", "updated_at"):
-        data.setdefault(k, None if k != "access" else "0")
-
-    _state_cache = data
-    _cache_time = now
-    return data.copy()
-
-def save_state(state: Dict[str, Any]) -> None:
-    """Thread-safe Speichern + Cache aktualisieren."""
-    tmp = state.copy()
-    tmp["updated_at"] = _now_iso()
-    with STATE_FILE.open("w") as f:
-        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            fields[f.name] = msgspec.convert(value, f.type, strict=False)
+        except msgspec.ValidationError:
+            if f.type is str and isinstance(value, (int, float)) and not isinstance(value, bool):
+                fields[f.name] = str(value)  # z. B. "access": 1 -> "1"
+            else:
+                app_logger.warning(f"State field {f.name!r} invalid ({value!r}), using default")
+    return State(**fields)
+
+def _read_state_file() -> State:
+    if not STATE_FILE.exists():
+        return State()
+
+    data = STATE_FILE.read_bytes()
+    try:
+        # Parsen + Validieren in einem Durchlauf
+        return _state_decoder.decode(data)
+    except msgspec.ValidationError as e:
+        # Gültiges JSON, aber einzelne Felder falsch typisiert (z. B. von Hand editiert)
+        app_logger.warning(f"State file {STATE_FILE} has invalid fields, salvaging: {e}")
+        return _salvage_state(msgspec.json.decode(data))
+    except msgspec.DecodeError as e:
+        # z. B. Altbestand aus der Zeit vor os.replace -> mit Defaults weiter
+        app_logger.warning(f"State file {STATE_FILE} unreadable, using defaults: {e}")
+        return State()
+
+def _write_state_file(state: State) -> None:
+    """Atomar schreiben: Leser sehen alte oder neue Datei, nie eine halbe."""
+    tmp_path = STATE_FILE.with_suffix(".json.tmp")
+    with tmp_path.open("wb") as f:
+        f.write(_state_encoder.encode(state))
+        f.flush()
+        os.fsync(f.fileno())  # Inhalt auf Platte, bevor der Name umgehängt wird
+    os.replace(tmp_path, STATE_FILE)
+
+def _flush_state() -> None:
+    """Schreibt den aktuellen State, falls seit dem letzten Flush geändert."""
+    global _persisted_rev
+    with _write_lock:
+        rev, state = _STATE
+        if _persisted_rev == rev:
+            return
+        _write_state_file(state)
+        _persisted_rev = rev
+
+def _persist_worker() -> None:
+    while True:
+        _persist_queue.get()
+        time.sleep(STATE_FLUSH_DELAY)
+        # Alle inzwischen eingereihten Änderungen mit abdecken
+        while True:
+            try:
+                _persist_queue.get_nowait()
+            except queue.Empty:
+                break
         try:
-            json.dump(tmp, f)
-        finally:
-            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
-    # Cache aktualisieren
-    global _state_cache, _cache_time
-    _state_cache = tmp
-    _cache_time = time.time()
+            _flush_state()
+        except Exception as e:
+            app_logger.error(f"State persist failed: {e}")
+
+_STATE: Tuple[int, State] = (0, _read_state_file())
+threading.Thread(target=_persist_worker, name="state-writer", daemon=True).start()
+atexit.register(_flush_state)
+
+def load_state() -> State:
+    """Lock-freies Lesen des aktuellen Snapshots (read-only, kein Datei-I/O)."""
+    return _STATE[1]
+
+def save_state(state: State, expected_rev: Optional[int] = None) -> State:
+    """
+    Thread-safe Aktualisieren; Persistierung erfolgt im Hintergrund. Gibt den neuen State zurück.
+    Mit expected_rev nur speichern, wenn kein anderer Schreiber den State seitdem ersetzt hat;
+    sonst bleibt der neuere State bestehen und wird zurückgegeben.
+    """
+    global _STATE
+    tmp = msgspec.structs.replace(state, updated_at=_now_iso())
+    with _state_lock:
+        if expected_rev is not None and _STATE[0] != expected_rev:
+            return _STATE[1]
+        rev = _STATE[0] + 1
+        _STATE = (rev, tmp)
+    _persist_queue.put(rev)
+    return tmp
 
 # -------------------- Helpers --------------------
 def require_token() -> None:
@@ -123,6 +254,22 @@ def validate_params(voltage: float, max_current: float) -> None:
     if not (CURR_MIN < max_current <= CURR_MAX):
         raise ValueError(f"Current {max_current} A außerhalb sicherer Grenzen ({CURR_MIN}, {CURR_MAX}]")
 
+_fmt1 = "{:.1f}".format
+_fmt2 = "{:.2f}".format
+
+@lru_cache(maxsize=128)
+def _device_payload_items(voltage: float, max_current: float, access: str) -> Tuple[Tuple[str, str], ...]:
+    """Formatierte Felder je (voltage, max_current, access) – Sequenzen wiederholen sich oft."""
+    vs = _fmt1(voltage)  # voltageValue == balancedVoltage
+    return (
+        ("voltageValue", vs),
+        ("currentValue", _fmt2(max_current)),
+        ("accessibilityStatus", str(access or "0")),
+        ("balancedVoltage", vs),
+        ("balancedCurrent", _fmt1(_clamp_balanced_amp(BALANCED_AMP_ENV))),
+        ("mode", "2"),
+    )
+
 def payload_for_device(voltage: float, max_current: float, access: str) -> Dict[str, Any]:
     """
     Baut das JSON für /api/send_data. Das Gerät erwartet:
@@ -132,73 +279,159 @@ def payload_for_device(voltage: float, max_current: float, access: str) -> Dict[
       - balancedCurrent in [1..5]
       - mode "2"
     """
-    balanced_amp = _clamp_balanced_amp(BALANCED_AMP_ENV)
-    return {
-        "voltageValue": f"{voltage:.1f}",
-        "currentValue": f"{max_current:.2f}",
-        "accessibilityStatus": str(access or "0"),
-        "balancedVoltage": f"{voltage:.1f}",
-        "balancedCurrent": f"{balanced_amp:.1f}",
-        "mode": "2",
-    }
+    # Frisches dict pro Aufruf: der Cache-Eintrag selbst bleibt unveränderlich
+    return dict(_device_payload_items(voltage, max_current, access))
 
 def _parse_float(v: Any) -> Optional[float]:
     if v is None:
         return None
-    try:
+    if isinstance(v, (int, float)):
         return float(v)
-    except Exception:
-        # evtl. Strings mit ' V'/' A' säubern
-        if isinstance(v, str):
-            for suf in (" V", "V", " A", "A"):
-                if v.endswith(suf):
-                    try:
-                        return float(v.replace(suf, ""))
-                    except Exception:
-                        pass
+    if isinstance(v, str):
+        # Nur Einheiten-Suffix (' V'/' A') am Ende entfernen, "1 234" bleibt ungültig
+        s = v.rstrip(" VA")
+        if not s:
+            return None
+        try:
+            return float(s)
+        except ValueError:
+            return None
     return None
 
 # -------------------- PSU HTTP (mit Retries) --------------------
-@retry(
-    reraise=True,
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=0.5, min=0.5, max=2),
-    retry=retry_if_exception_type((requests.exceptions.ConnectionError, requests.exceptions.Timeout))
-)
+_RETRY_EXC = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+_RETRY_ATTEMPTS = 3
+
+def _psu_request(method: str, path: str, attempts: int = _RETRY_ATTEMPTS,
+                 timeout: Tuple[float, float] = _TIMEOUT, **kwargs: Any) -> requests.Response:
+    """
+    Bis zu 3 Versuche bei Verbindungsfehler/Timeout, Backoff 0.5 s -> 1 s (max 2 s).
+    Schlichte Schleife: im Erfolgsfall kein Retry-Overhead.
+    """
+    delay = 0.5
+    for attempt in range(attempts):
+        try:
+            r = session.request(method, _PSU_URLS[path], timeout=timeout, **kwargs)
+            r.raise_for_status()
+            return r
+        except _RETRY_EXC:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(delay)
+            delay = min(delay * 2, 2.0)
+    raise AssertionError("unreachable")
+
+# Conditional GET: liefert die PSU ETag/Last-Modified, wird beim nächsten Abruf
+# revalidiert; 304 -> zuletzt geparster Body ohne erneutes JSON-Parsing.
+_conditional: Dict[str, Tuple[Dict[str, str], Dict[str, Any]]] = {}
+
+def _psu_fetch(path: str) -> Dict[str, Any]:
+    cached = _conditional.get(path)
+    r = _psu_request("GET", path, headers=cached[0] if cached else None)
+    if r.status_code == 304 and cached:
+        return cached[1]
+
+    data = orjson.loads(r.content)
+    validators = {}
+    if etag := r.headers.get("ETag"):
+        validators["If-None-Match"] = etag
+    if last_modified := r.headers.get("Last-Modified"):
+        validators["If-Modified-Since"] = last_modified
+    if validators:
+        _conditional[path] = (validators, data)
+    else:
+        _conditional.pop(path, None)
+    return data
+
+# -------------------- PSU Read-Cache (TTL) --------------------
+# /health, /psu/status und /psu/current lesen dasselbe Endpoint -> kurze TTL
+# fasst Bursts (z. B. Monitoring-Probes) zu einem PSU-Roundtrip zusammen.
+TTL_PATH: Dict[str, float] = {"/api/chargeStatus": STATUS_TTL}
+
+_get_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+# Generation je Pfad: _invalidate zählt hoch, damit ein Read, der vor einem
+# Schreibzugriff gestartet ist, seinen (veralteten) Body nicht mehr cached.
+_get_gen: Dict[str, int] = {}
+_get_cache_lock = threading.Lock()
+
+def _invalidate(path: str) -> None:
+    with _get_cache_lock:
+        _get_cache.pop(path, None)
+        _get_gen[path] = _get_gen.get(path, 0) + 1
+
+def _generation(path: str) -> int:
+    with _get_cache_lock:
+        return _get_gen.get(path, 0)
+
 def psu_get(path: str) -> Dict[str, Any]:
-    r = session.get(f"{PSU_BASE}{path}", timeout=HTTP_TIMEOUT)
-    r.raise_for_status()
-    return r.json()
-
-@retry(
-    reraise=True,
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=0.5, min=0.5, max=2),
-    retry=retry_if_exception_type((requests.exceptions.ConnectionError, requests.exceptions.Timeout))
-)
+    now = time.monotonic()
+    with _get_cache_lock:
+        hit = _get_cache.get(path)
+        gen = _get_gen.get(path, 0)
+    if hit and now < hit[0]:
+        return copy.deepcopy(hit[1])
+
+    data = _psu_fetch(path)
+    with _get_cache_lock:
+        if _get_gen.get(path, 0) == gen:
+            _get_cache[path] = (time.monotonic() + TTL_PATH.get(path, 1.0), data)
+    return copy.deepcopy(data)
+
 def psu_post(path: str, payload: Dict[str, Any]) -> str:
-    r = session.post(f"{PSU_BASE}{path}", json=payload, timeout=HTTP_TIMEOUT)
-    r.raise_for_status()
-    return r.text
+    try:
+        return _psu_request("POST", path, data=orjson.dumps(payload), headers=_JSON_HEADERS).text
+    finally:
+        if path == "/api/send_data":
+            # Nach einem (auch fehlgeschlagenen) Schreibzugriff den Status frisch lesen
+            _invalidate("/api/chargeStatus")
+
+# -------------------- PSU Reachability (für /health) --------------------
+# Letztes Probe-Ergebnis wird HEALTH_TTL Sekunden wiederverwendet; Probe selbst
+# ohne Retries und mit knappem Timeout -> eine tote PSU blockiert /health nicht.
+_HEALTH_TIMEOUT = (1.0, 1.0)
+_psu_health: Tuple[float, bool] = (float("-inf"), False)
+_health_lock = threading.Lock()
+
+def psu_reachable() -> bool:
+    global _psu_health
+    ts, ok = _psu_health
+    if time.monotonic() - ts < HEALTH_TTL:
+        return ok
+    # Nur ein Thread probt; parallele Aufrufer nehmen den letzten bekannten Wert.
+    # Gibt es noch keinen (z. B. während des Warmups), wird auf die Probe gewartet.
+    if not _health_lock.acquire(blocking=ts == float("-inf")):
+        return ok
+    try:
+        ts, ok = _psu_health
+        if time.monotonic() - ts < HEALTH_TTL:
+            return ok
+        try:
+            _psu_request("GET", "/api/chargeStatus", attempts=1, timeout=_HEALTH_TIMEOUT)
+            ok = True
+        except Exception as e:
+            app_logger.warning(f"Health PSU check failed: {e}")
+            ok = False
+        _psu_health = (time.monotonic(), ok)
+        return ok
+    finally:
+        _health_lock.release()
+
+# Pool beim Start vorwärmen (Keep-Alive-Socket steht für den ersten Request bereit)
+# und dabei gleich den Reachability-Status für /health setzen; im Hintergrund,
+# damit eine nicht erreichbare PSU den Start nicht verzögert.
+threading.Thread(target=psu_reachable, name="psu-warmup", daemon=True).start()
 
 # -------------------- Routes --------------------
 @app.get("/health")
+@limiter.exempt
 def health():
-    psu_ok = False
-    last_comm = load_state().get("updated_at")
-    try:
-        # schneller Reachability-Check
-        psu_get("/api/chargeStatus")
-        psu_ok = True
-    except Exception as e:
-        app_logger.warning(f"Health PSU check failed: {e}")
-
     return jsonify({
         "bridge_ok": True,
-        "psu_reachable": psu_ok,
+        "psu_reachable": psu_reachable(),
         "psu_base": PSU_BASE,
         "state_file": str(STATE_FILE),
-        "last_communication": last_comm,
+        "last_communication": load_state().updated_at,
+        "psu_connections_opened": _psu_connections_opened,
         "version": "1.5.0",
         "features": {"retry": True, "rate_limit": True}
     })
@@ -219,8 +452,7 @@ def psu_status():
 @app.get("/psu/current")
 def psu_current():
     require_token()
-    state = load_state()
-    set_max_current = state.get("max_current")
+    set_max_current = load_state().max_current
     try:
         js = psu_get("/api/chargeStatus")
         current_now = _parse_float(js.get("currentNow"))
@@ -279,8 +511,8 @@ def set_voltage_current():
     try:
         resp_text = psu_post("/api/send_data", payload)
         # Persistierter Soll-State
-        save_state({"voltage": voltage, "max_current": max_current, "access": access})
-        return jsonify({"sent": payload, "psu_response": resp_text, "state": load_state()})
+        state = save_state(State(voltage=voltage, max_current=max_current, access=access))
+        return jsonify({"sent": payload, "psu_response": resp_text, "state": state})
     except requests.exceptions.ConnectionError:
         app_logger.error("PSU communication failed: connection error")
         return jsonify({"error": "PSU nicht erreichbar", "sent": payload}), 503
@@ -296,6 +528,16 @@ def set_voltage_current():
 def set_vc_alias():
     return set_voltage_current()
 
+def _sequence_state(last_sent: Optional[Tuple[float, float, str]], sent_rev: int) -> State:
+    """
+    Ein State-Update pro Sequenz (letzter erfolgreich gesendeter Schritt). Hat seit
+    diesem POST ein anderer Request (z. B. /set) gespeichert, gewinnt dessen State.
+    """
+    if last_sent is None:
+        return load_state()
+    v, i, a = last_sent
+    return save_state(State(voltage=v, max_current=i, access=a), expected_rev=sent_rev)
+
 @app.post("/set_sequence")
 @_limit("5 per minute")
 def set_sequence():
@@ -318,6 +560,11 @@ def set_sequence():
         return jsonify({"error": "Max 10 steps allowed"}), 400
 
     results = []
+    last_sent: Optional[Tuple[float, float, str]] = None
+    sent_rev = 0
+    sent_gen = -1
+    psu_resp = None
+    saved = False
     for idx, step in enumerate(seq, start=1):
         try:
             v = float(step["voltage"])
@@ -325,23 +572,42 @@ def set_sequence():
             a = str(step.get("access", "0"))
             validate_params(v, i)
             payload = payload_for_device(v, i, a)
-            app_logger.info(f"[seq {idx}/{len(seq)}] Setting PSU: V={v}V, Imax={i}A, access={a}")
-            psu_resp = psu_post("/api/send_data", payload)
-            save_state({"voltage": v, "max_current": i, "access": a})
-            results.append({"step": idx, "sent": payload, "psu_response": psu_resp, "ok": True})
+            # psu_post("/api/send_data") zählt die chargeStatus-Generation hoch: unverändert
+            # seit unserem letzten POST -> kein anderer Client hat inzwischen gesetzt
+            if (v, i, a) == last_sent and _generation("/api/chargeStatus") == sent_gen:
+                # Identischer Folgeschritt: PSU hat diese Werte bereits -> kein erneuter Roundtrip
+                app_logger.info(f"[seq {idx}/{len(seq)}] Unchanged, skipping PSU write")
+                results.append({"step": idx, "sent": payload, "psu_response": psu_resp, "ok": True, "repeated": True})
+            else:
+                app_logger.info(f"[seq {idx}/{len(seq)}] Setting PSU: V={v}V, Imax={i}A, access={a}")
+                psu_resp = psu_post("/api/send_data", payload)
+                last_sent = (v, i, a)
+                sent_rev = _STATE[0]
+                sent_gen = _generation("/api/chargeStatus")
+                results.append({"step": idx, "sent": payload, "psu_response": psu_resp, "ok": True})
         except Exception as e:
             app_logger.error(f"[seq {idx}] failed: {e}")
             results.append({"step": idx, "error": str(e), "ok": False})
             # optional: abbrechen
             break
 
+        if idx == len(seq):
+            # Letzter Schritt: State sofort sichern, nicht erst nach dessen Delay
+            _sequence_state(last_sent, sent_rev)
+            saved = True
+
         delay = float(step.get("delay", 0))
         if delay > 0:
             time.sleep(min(delay, 10))  # maximal 10s pro Schritt
 
+    if not saved:
+        # Abbruch: der fehlgeschlagene Schritt hat kein Delay mehr -> jetzt sichern
+        _sequence_state(last_sent, sent_rev)
+    # Aktueller Snapshot (lock-frei): nach einem Delay evtl. schon von /set überholt
     return jsonify({"results": results, "state": load_state()})
 
 # -------------------- Main --------------------
 if __name__ == "__main__":
+    # Nur für Entwicklung; Produktion: gunicorn -k gevent --workers 1 app:app (siehe README).
     # Hinweis: Kein SocketIO, daher keine Werkzeug-Production-Warnung.
     app.run(host="0.0.0.0", port=PORT)